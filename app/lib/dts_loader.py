@@ -1,38 +1,112 @@
 from __future__ import annotations
 
+import contextlib
+import functools
+import hashlib
+import os
+import tempfile
 from pathlib import Path
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pacsv
+import pyarrow.parquet as pq
+import streamlit as st
+from pandas.api.types import CategoricalDtype
 
 REPO_ROOT = Path(__file__).resolve().parents[2]
 DATA_RAW = REPO_ROOT / "data" / "raw"
+DATA_CACHE = REPO_ROOT / "data" / "cache"
 
+# Part of every Parquet cache name; bump it whenever a loader's output (columns, dtypes,
+# filtering) changes so caches written by older code are ignored instead of reused
+_CACHE_VERSION = 1
 
-def _find_first_csv(candidates: list[str]) -> Path:
+_ARROW_STRINGS = {pa.string(): pd.StringDtype("pyarrow"), pa.large_string(): pd.StringDtype("pyarrow")}
+
+
+def _find_first_csv(candidates: tuple[str, ...]) -> Path:
     if not DATA_RAW.exists():
         raise FileNotFoundError(f"Expected folder not found: {DATA_RAW}")
 
+    # Keyed on the folder's mtime, so a renamed or newly downloaded CSV is picked up without a restart
+    return _detect_csv(candidates, DATA_RAW.stat().st_mtime_ns)
+
+
+@functools.lru_cache(maxsize=16)
+def _detect_csv(candidates: tuple[str, ...], raw_mtime_ns: int) -> Path:
     csvs = list(DATA_RAW.glob("*.csv"))
     if not csvs:
         raise FileNotFoundError(f"No CSV files found in {DATA_RAW}")
 
+    lowered = [(f, f.name.lower()) for f in csvs]
     for c in candidates:
-        for f in csvs:
-            if c.lower() in f.name.lower():
+        c = c.lower()
+        for f, name in lowered:
+            if c in name:
                 return f
 
     raise FileNotFoundError(
         "Could not auto-detect required CSV. "
-        f"Looked for {candidates} in filenames under {DATA_RAW}. "
+        f"Looked for {list(candidates)} in filenames under {DATA_RAW}. "
         f"Found: {[f.name for f in csvs]}"
     )
 
 
 def find_deposits_withdrawals_csv() -> Path:
-    return _find_first_csv(["deposits", "withdrawals", "operating cash", "dwoc", "opcash"])
+    return _find_first_csv(("deposits", "withdrawals", "operating cash", "dwoc", "opcash"))
 
 
 def find_category_map_csv() -> Path:
-    return _find_first_csv(["category_map", "cat_map", "mapping", "rollup", "opcash_category_map"])
+    return _find_first_csv(("category_map", "cat_map", "mapping", "rollup", "opcash_category_map"))
+
+
+def _cached_parquet(path: Path) -> Path:
+    return path.with_suffix(f".v{_CACHE_VERSION}.parquet")
+
+
+def _is_fresh(cache_path: Path, source_path: Path) -> bool:
+    return cache_path.exists() and cache_path.stat().st_mtime >= source_path.stat().st_mtime
+
+
+def _read_parquet(cache_path: Path) -> pd.DataFrame:
+    # Keep text columns Arrow-backed on the way back in, matching what the CSV loaders produce
+    return pq.read_table(cache_path).to_pandas(types_mapper=_ARROW_STRINGS.get)
+
+
+def _read_cached(cache_path: Path) -> pd.DataFrame | None:
+    # A cache that can't be read back (e.g. truncated by a crash) is a miss: drop it so it gets rebuilt
+    try:
+        return _read_parquet(cache_path)
+    except (pa.ArrowInvalid, OSError):
+        with contextlib.suppress(OSError):
+            cache_path.unlink(missing_ok=True)
+        return None
+
+
+def _write_parquet(df: pd.DataFrame, cache_path: Path, index: bool = False) -> None:
+    # Best effort: a read-only data folder just means we re-parse the CSV next time. The file is
+    # written beside the target and renamed into place, so readers never see a partial write.
+    tmp_path = None
+    try:
+        with tempfile.NamedTemporaryFile(
+            dir=cache_path.parent, prefix=f"{cache_path.name}.", suffix=".tmp", delete=False
+        ) as f:
+            tmp_path = Path(f.name)
+            df.to_parquet(f, engine="pyarrow", compression="zstd", index=index)
+        os.replace(tmp_path, cache_path)
+    except OSError:
+        pass
+    finally:
+        if tmp_path is not None:
+            with contextlib.suppress(OSError):
+                tmp_path.unlink(missing_ok=True)
+
+
+def _strip(s: pd.Series) -> pd.Series:
+    # One Arrow utf8 kernel pass over the whole buffer instead of pandas' per-element str.strip
+    return pd.Series(pc.utf8_trim_whitespace(pa.array(s)), index=s.index, dtype="string[pyarrow]")
 
 
 def load_category_map(path: Path | None = None) -> pd.DataFrame:
@@ -45,9 +119,18 @@ def load_category_map(path: Path | None = None) -> pd.DataFrame:
       - program_rollup
 
     It may also contain transaction_type (we'll keep it, but we won't join on it).
+
+    The normalized mapping is cached as a sibling .parquet file and reused
+    until the CSV is modified again.
     """
     path = path or find_category_map_csv()
-    m = pd.read_csv(path, dtype=str).copy()
+    parquet_path = _cached_parquet(path)
+    if _is_fresh(parquet_path, path):
+        cached = _read_cached(parquet_path)
+        if cached is not None:
+            return cached
+
+    m = pd.read_csv(path, dtype="string[pyarrow]")
 
     m.columns = [c.strip() for c in m.columns]
     if "transaction_cetg_desc" in m.columns and "transaction_catg_desc" not in m.columns:
@@ -64,27 +147,51 @@ def load_category_map(path: Path | None = None) -> pd.DataFrame:
     if missing:
         raise ValueError(f"Mapping file missing columns: {sorted(missing)}. Found: {list(m.columns)}")
 
-    # Normalize join keys
-    m["transaction_catg"] = m["transaction_catg"].astype("string").str.strip()
-    m["transaction_catg_desc"] = m["transaction_catg_desc"].astype("string").str.strip()
-
-    # Normalize rollups
-    for col in ["cabinet_supercategory", "agency_rollup", "program_rollup"]:
-        m[col] = m[col].astype("string").str.strip()
-
-    # If transaction_type exists, normalize it too (not used in join but useful for QA)
+    # Normalize join keys and rollups (transaction_type too, if present: not used in join but useful for QA)
+    for col in ["transaction_catg", "transaction_catg_desc", "cabinet_supercategory", "agency_rollup", "program_rollup"]:
+        m[col] = _strip(m[col])
     if "transaction_type" in m.columns:
-        m["transaction_type"] = m["transaction_type"].astype("string").str.strip()
+        m["transaction_type"] = _strip(m["transaction_type"])
 
     # Optional: drop exact duplicate mappings on the join keys (keeps merge deterministic)
     m = m.drop_duplicates(subset=["transaction_catg", "transaction_catg_desc"], keep="first")
 
+    _write_parquet(m, parquet_path)
     return m
 
 
 def load_deposits_withdrawals(path: Path | None = None) -> pd.DataFrame:
+    """
+    Load the Deposits/Withdrawals of Operating Cash CSV, filtered and scaled to dollars.
+
+    The cleaned frame is cached as a sibling .parquet file and reused until
+    the CSV is modified again.
+    """
     path = path or find_deposits_withdrawals_csv()
-    df = pd.read_csv(path).copy()
+    parquet_path = _cached_parquet(path)
+    if _is_fresh(parquet_path, path):
+        cached = _read_cached(parquet_path)
+        if cached is not None:
+            return cached
+
+    # Arrow's CSV reader tokenizes and converts on multiple threads
+    table = pacsv.read_csv(
+        path,
+        convert_options=pacsv.ConvertOptions(
+            column_types={
+                "record_date": pa.string(),
+                "account_type": pa.string(),
+                "transaction_type": pa.string(),
+                "transaction_catg": pa.string(),
+                "transaction_catg_desc": pa.string(),
+                "transaction_today_amt": pa.string(),
+            },
+            # Match pandas: blank cells (e.g. an empty transaction_catg_desc) are nulls, not "".
+            # Amounts are read as text too so a stray "*" or "n/a" becomes null (then 0, then
+            # dropped) like pd.to_numeric(errors="coerce"), instead of failing the whole load.
+            strings_can_be_null=True,
+        ),
+    )
 
     required = {
         "record_date",
@@ -94,61 +201,223 @@ def load_deposits_withdrawals(path: Path | None = None) -> pd.DataFrame:
         "transaction_catg_desc",
         "transaction_today_amt",
     }
-    missing = required - set(df.columns)
+    missing = required - set(table.column_names)
     if missing:
         raise ValueError(f"Deposits/Withdrawals CSV missing columns: {sorted(missing)}")
 
-    df["record_date"] = pd.to_datetime(df["record_date"], errors="coerce")
-    df = df[df["record_date"].notna()].copy()
-
-    df["transaction_today_amt"] = pd.to_numeric(df["transaction_today_amt"], errors="coerce").fillna(0.0)
-
-    # Amounts are in millions -> dollars
-    df["transaction_today_amt"] = df["transaction_today_amt"] * 1_000_000
-
     for c in ["account_type", "transaction_type", "transaction_catg", "transaction_catg_desc"]:
-        df[c] = df[c].astype("string").str.strip()
+        table = table.set_column(table.schema.get_field_index(c), c, pc.utf8_trim_whitespace(table[c]))
+
+    raw_date = table["record_date"].combine_chunks()
+    record_date = pc.strptime(raw_date, format="%Y-%m-%d", unit="ns", error_is_null=True)
+    unparsed = pc.and_(pc.is_null(record_date), pc.is_valid(raw_date))
+    if pc.any(unparsed).as_py():
+        # Not ISO (e.g. the CSV was re-saved by Excel as 01/02/2023): let pandas infer the format
+        # for just those cells, as the pd.to_datetime(errors="coerce") path did
+        fallback = pd.to_datetime(raw_date.filter(unparsed).to_pandas(), errors="coerce")
+        record_date = pc.replace_with_mask(record_date, unparsed, pa.array(fallback, type=pa.timestamp("ns")))
+    if len(raw_date) and not pc.any(pc.is_valid(record_date)).as_py():
+        raise ValueError(f"Deposits/Withdrawals CSV has no parseable record_date values: {path}")
+    raw_amt = pc.utf8_trim_whitespace(table["transaction_today_amt"])
+    numeric = pc.match_substring_regex(raw_amt, r"^[-+]?(\d+\.?\d*|\.\d+)([eE][-+]?\d+)?$")
+    amt = pc.cast(pc.if_else(numeric, raw_amt, pa.scalar(None, pa.string())), pa.float64())
+    amt = pc.fill_null(amt, 0.0)
+
+    # Build every row filter as one mask so the table is sliced once instead of per rule
+    keep = pc.and_(pc.is_valid(record_date), pc.not_equal(amt, 0.0))
 
     # Exclude TGA total lines entirely (they'll otherwise double-count flows)
-    df = df[~df["account_type"].isin([
+    keep = pc.and_(keep, pc.invert(pc.is_in(table["account_type"], value_set=pa.array([
         "Treasury General Account Total Deposits",
         "Treasury General Account Total Withdrawals",
-    ])].copy()
+    ]))))
 
     # Exclude TGA sub-total lines entirely
-    df = df[~df["transaction_catg"].isin([
+    keep = pc.and_(keep, pc.invert(pc.is_in(table["transaction_catg"], value_set=pa.array([
         "Sub-Total Deposits",
         "Sub-Total Withdrawals",
         "Public Debt Cash Issues (Table III-B)",
         "Public Debt Cash Issues (Table IIIB)",
         "Public Debt Cash Redemp. (Table III-B)",
         "Public Debt Cash Redemp. (Table IIIB)"
-    ])].copy()
+    ]))))
 
-    df = df[df["transaction_today_amt"] != 0].copy()
+    # Amounts are in millions -> whole dollars. int64 keeps sums exact (annual flows ~1e13 << 9.2e18)
+    amt = pc.cast(pc.round(pc.multiply(amt, 1_000_000.0)), pa.int64())
+
+    table = table.set_column(table.schema.get_field_index("record_date"), "record_date", record_date)
+    table = table.set_column(table.schema.get_field_index("transaction_today_amt"), "transaction_today_amt", amt)
+    # Sorted by date so callers can slice ranges with a binary search (Arrow's sort is stable)
+    table = table.filter(keep).sort_by([("record_date", "ascending")])
+
+    df = table.to_pandas(types_mapper=_ARROW_STRINGS.get)
+
+    _write_parquet(df, parquet_path)
     return df
 
 
 def enrich_with_rollups(df: pd.DataFrame, mapping: pd.DataFrame) -> pd.DataFrame:
     """
     Left-join mapping on (transaction_catg, transaction_catg_desc).
+
+    Grouping/filter columns come back as categoricals so the pages hash
+    small integer codes instead of full strings.
     """
-    out = df.merge(
-        mapping[
-            [
-                "transaction_catg",
-                "transaction_catg_desc",
-                "cabinet_supercategory",
-                "agency_rollup",
-                "program_rollup",
-            ]
-        ],
-        on=["transaction_catg", "transaction_catg_desc"],
-        how="left",
+    mapping = mapping[
+        [
+            "transaction_catg",
+            "transaction_catg_desc",
+            "cabinet_supercategory",
+            "agency_rollup",
+            "program_rollup",
+        ]
+    ]
+
+    # Share one categorical dtype across both sides so the merge joins on integer codes
+    shared = CategoricalDtype(
+        categories=sorted(
+            set(df["transaction_catg"].dropna().unique()).union(mapping["transaction_catg"].dropna().unique())
+        )
     )
+    df = df.assign(transaction_catg=df["transaction_catg"].astype(shared))
+    mapping = mapping.assign(transaction_catg=mapping["transaction_catg"].astype(shared))
+
+    out = df.merge(mapping, on=["transaction_catg", "transaction_catg_desc"], how="left")
 
-    out["cabinet_supercategory"] = out["cabinet_supercategory"].fillna("Unmapped")
-    out["agency_rollup"] = out["agency_rollup"].fillna("Unmapped")
-    out["program_rollup"] = out["program_rollup"].fillna("Unmapped")
+    out = out.fillna({
+        "cabinet_supercategory": "Unmapped",
+        "agency_rollup": "Unmapped",
+        "program_rollup": "Unmapped",
+    })
+
+    for c in ["account_type", "transaction_type", "cabinet_supercategory", "agency_rollup", "program_rollup"]:
+        out[c] = out[c].astype("category")
 
     return out
+
+
+def _enriched_cache_path(dw_path: Path, map_path: Path) -> Path:
+    stamp = f"{_CACHE_VERSION}-{dw_path.stat().st_mtime_ns}-{map_path.stat().st_mtime_ns}"
+    key = hashlib.blake2b(stamp.encode()).hexdigest()[:16]
+    return DATA_CACHE / f"enriched-{key}.parquet"
+
+
+def load_enriched() -> pd.DataFrame:
+    """
+    Deposits/Withdrawals joined to the rollup mapping, indexed by a sorted record_date.
+
+    The result is cached under data/cache keyed by both source files' mtimes,
+    so a fresh process skips the loader entirely until either CSV changes.
+    """
+    dw_path = find_deposits_withdrawals_csv()
+    map_path = find_category_map_csv()
+    cache_path = _enriched_cache_path(dw_path, map_path)
+    if cache_path.exists():
+        cached = _read_cached(cache_path)
+        if cached is not None:
+            return cached
+
+    df = load_deposits_withdrawals(dw_path)
+    mapping = load_category_map(map_path)
+    # A sorted DatetimeIndex turns date-range filters into a binary-search slice
+    out = enrich_with_rollups(df, mapping).set_index("record_date").sort_index()
+
+    # Drop caches built from older versions of the source files; like the write itself this
+    # is best effort, so a read-only checkout still gets the freshly built frame
+    try:
+        DATA_CACHE.mkdir(parents=True, exist_ok=True)
+        for stale in DATA_CACHE.glob("enriched-*.parquet"):
+            stale.unlink(missing_ok=True)
+    except OSError:
+        return out
+    _write_parquet(out, cache_path, index=True)
+    return out
+
+
+def slice_dates(df: pd.DataFrame, start, end) -> pd.DataFrame:
+    """
+    Rows of a frame indexed by a sorted record_date with start <= record_date <= end.
+
+    Two binary searches over the index's datetime64 values replace a full-column
+    boolean mask, and the positional slice is a view.
+    """
+    dates = df.index.to_numpy()
+    lo = dates.searchsorted(np.datetime64(start))
+    hi = dates.searchsorted(np.datetime64(end), side="right")
+    return df.iloc[lo:hi]
+
+
+def cat_eq(s: pd.Series, value: str) -> np.ndarray:
+    """
+    Boolean mask for s == value on a categorical column, compared on integer codes.
+    """
+    categories = s.cat.categories
+    if value not in categories:
+        return np.zeros(len(s), dtype=bool)
+    return s.cat.codes.to_numpy() == categories.get_loc(value)
+
+
+# The cache_resource helpers below hand every session the same frames. Under copy-on-write,
+# slices of them share memory until written to, so pages filter without defensive .copy()
+# and a write on a slice can never reach the shared frame.
+pd.set_option("mode.copy_on_write", True)
+
+
+@st.cache_resource(show_spinner=True)
+def get_enriched() -> pd.DataFrame:
+    """
+    Process-wide handle on load_enriched(), shared by every page and session.
+    """
+    return load_enriched()
+
+
+# The daily rollups are cached like get_enriched: cache_resource hands every rerun the same
+# frame instead of unpickling a fresh copy, so callers must treat them as read-only.
+@st.cache_resource(show_spinner=True)
+def get_daily_cab() -> pd.DataFrame:
+    """
+    Daily totals per cabinet_supercategory, one column per transaction_type, indexed by record_date.
+    """
+    return (
+        get_enriched()
+        .groupby(["record_date", "transaction_type", "cabinet_supercategory"], observed=True, sort=False)[
+            "transaction_today_amt"
+        ]
+        .sum()
+        .unstack("transaction_type", fill_value=0)
+        .reindex(columns=["Deposits", "Withdrawals"], fill_value=0)
+        .reset_index("cabinet_supercategory")
+        .sort_index()
+    )
+
+
+@st.cache_resource(show_spinner=True)
+def get_daily_unmapped() -> pd.DataFrame:
+    """
+    Daily totals of unmapped rows per (transaction_type, transaction_catg, transaction_catg_desc),
+    indexed by record_date.
+    """
+    keys = ["transaction_type", "transaction_catg", "transaction_catg_desc"]
+    df = get_enriched()
+    return (
+        df[cat_eq(df["cabinet_supercategory"], "Unmapped")]
+        .groupby(["record_date", *keys], observed=True, sort=False)["transaction_today_amt"]
+        .sum()
+        .reset_index(level=keys)
+        .sort_index()
+    )
+
+
+@st.cache_resource(show_spinner=True)
+def get_daily_agency_program() -> pd.DataFrame:
+    """
+    Daily totals and row counts per (transaction_type, cabinet, agency, program), indexed by record_date.
+    """
+    keys = ["transaction_type", "cabinet_supercategory", "agency_rollup", "program_rollup"]
+    return (
+        get_enriched()
+        .groupby(["record_date", *keys], observed=True, sort=False)
+        .agg(transaction_today_amt=("transaction_today_amt", "sum"), rows=("transaction_today_amt", "size"))
+        .reset_index(level=keys)
+        .sort_index()
+    )
@@ -6,11 +6,12 @@ if str(REPO_ROOT) not in sys.path:
     sys.path.insert(0, str(REPO_ROOT))
 
 import streamlit as st
+import numpy as np
 import pandas as pd
 import plotly.graph_objects as go
 from datetime import timedelta
 
-from app.lib.dts_loader import load_deposits_withdrawals, load_category_map, enrich_with_rollups
+from app.lib.dts_loader import cat_eq, get_daily_cab, get_daily_unmapped, get_enriched, slice_dates
 
 
 st.set_page_config(page_title="Flows (Sankey)", layout="wide")
@@ -19,18 +20,73 @@ st.title("Flows through the Treasury General Account (TGA)")
 st.caption("MVP: Sum of daily amounts (transaction_today_amt) over the selected date range.")
 
 
-@st.cache_data(show_spinner=True)
-def get_enriched() -> pd.DataFrame:
-    df = load_deposits_withdrawals()
-    mapping = load_category_map()
-    return enrich_with_rollups(df, mapping)
+def get_cab_sums(start_date, end_date, show_unmapped: bool) -> pd.DataFrame:
+    """
+    Deposits/Withdrawals totals per cabinet over the date range, from the cached daily rollup.
+    """
+    cab_sums = (
+        slice_dates(get_daily_cab(), start_date, end_date)
+        .groupby("cabinet_supercategory", observed=True)
+        .sum()
+        .rename_axis(columns=None)
+    )
+    if not show_unmapped:
+        cab_sums = cab_sums.drop(index="Unmapped", errors="ignore")
+    return cab_sums
+
+
+def build_flows_sankey(cab_sums: pd.DataFrame) -> go.Figure:
+    """
+    Cabinet-level gross flows Sankey: deposit cabinets -> TGA -> withdrawal cabinets.
+    """
+    dep_by_cab = cab_sums.loc[cab_sums["Deposits"] != 0, "Deposits"]
+    wdr_by_cab = cab_sums.loc[cab_sums["Withdrawals"] != 0, "Withdrawals"]
+
+    tga_label = "Treasury General Account (TGA)"
+
+    # Node order is deposit cabinets, TGA, withdrawal cabinets, so indices are plain positions
+    n_dep = len(dep_by_cab)
+    n_wdr = len(wdr_by_cab)
+    tga_idx = n_dep
+
+    nodes_label = dep_by_cab.index.astype(str).tolist() + [tga_label] + wdr_by_cab.index.astype(str).tolist()
+
+    # Links: Deposits cabinets -> TGA, then TGA -> Withdrawals cabinets
+    sources = np.concatenate([np.arange(n_dep), np.full(n_wdr, tga_idx)])
+    targets = np.concatenate([np.full(n_dep, tga_idx), np.arange(tga_idx + 1, tga_idx + 1 + n_wdr)])
+    values = np.concatenate([dep_by_cab.to_numpy(dtype=np.float64), wdr_by_cab.to_numpy(dtype=np.float64)])
+
+    fig = go.Figure(
+        data=[
+            go.Sankey(
+                arrangement="snap",
+                textfont=dict(size=14, color="black"),
+                node=dict(
+                    label=nodes_label,  # <-- display labels (no prefixes)
+                    pad=15,
+                    thickness=15,
+                    line=dict(color="rgba(0,0,0,0.35)", width=1),
+                ),
+                link=dict(source=sources, target=targets, value=values),
+            )
+        ]
+    )
+    fig.update_layout(
+        height=650,
+        margin=dict(l=10, r=10, t=10, b=10),
+        paper_bgcolor="white",
+        plot_bgcolor="white",
+        font=dict(color="black"),
+    )
+
+    return fig
 
 
 df = get_enriched()
 
 # --- Controls
-max_date = df["record_date"].max()
-min_date = df["record_date"].min()
+max_date = df.index.max()
+min_date = df.index.min()
 default_start = max_date - timedelta(days=365)
 
 c1, c2, c3, c4 = st.columns([2, 1, 1, 1])
@@ -44,7 +100,7 @@ with c1:
     )
 
 with c2:
-    years = sorted(df["record_date"].dt.year.unique().tolist())
+    years = df.index.year.unique().tolist()
     year_choice = st.selectbox("Year (optional)", ["All"] + [str(y) for y in years], index=0)
 
 with c3:
@@ -60,15 +116,16 @@ if year_choice != "All":
     start_date = pd.Timestamp(year=y, month=1, day=1).date()
     end_date = pd.Timestamp(year=y, month=12, day=31).date()
 
-mask = (df["record_date"].dt.date >= start_date) & (df["record_date"].dt.date <= end_date)
-dff = df.loc[mask].copy()
+cab_sums = get_cab_sums(start_date, end_date, show_unmapped)
 
-if not show_unmapped:
-    dff = dff[dff["cabinet_supercategory"] != "Unmapped"].copy()
+# One deposits/withdrawals/net table feeds the metrics, the net view and the click table
+cab_tbl = cab_sums.rename(columns={"Deposits": "deposits", "Withdrawals": "withdrawals"}).reset_index()
+cab_tbl["net"] = cab_tbl["deposits"] - cab_tbl["withdrawals"]
+cab_tbl = cab_tbl.sort_values("withdrawals", ascending=False)
 
 # --- Summary metrics
-total_deposits = dff.loc[dff["transaction_type"] == "Deposits", "transaction_today_amt"].sum()
-total_withdrawals = dff.loc[dff["transaction_type"] == "Withdrawals", "transaction_today_amt"].sum()
+total_deposits = cab_tbl["deposits"].sum()
+total_withdrawals = cab_tbl["withdrawals"].sum()
 net = total_deposits - total_withdrawals
 
 m1, m2, m3 = st.columns(3)
@@ -80,115 +137,20 @@ st.divider()
 
 # --- Net table option
 if view_choice.startswith("Net"):
-    dep = (
-        dff[dff["transaction_type"] == "Deposits"]
-        .groupby("cabinet_supercategory", as_index=False)["transaction_today_amt"]
-        .sum()
-        .rename(columns={"transaction_today_amt": "deposits"})
-    )
-    wdr = (
-        dff[dff["transaction_type"] == "Withdrawals"]
-        .groupby("cabinet_supercategory", as_index=False)["transaction_today_amt"]
-        .sum()
-        .rename(columns={"transaction_today_amt": "withdrawals"})
-    )
-
-    net_tbl = dep.merge(wdr, on="cabinet_supercategory", how="outer").fillna(0.0)
-    net_tbl["net"] = net_tbl["deposits"] - net_tbl["withdrawals"]
-    net_tbl = net_tbl.sort_values("withdrawals", ascending=False)
-
     st.subheader("Net by cabinet")
     st.dataframe(
-        net_tbl.style.format({"deposits": "${:,.0f}", "withdrawals": "${:,.0f}", "net": "${:,.0f}"}),
+        cab_tbl.style.format({"deposits": "${:,.0f}", "withdrawals": "${:,.0f}", "net": "${:,.0f}"}),
         use_container_width=True,
     )
     st.stop()
 
-# --- Build Sankey (gross)
-dep_by_cab = (
-    dff[dff["transaction_type"] == "Deposits"]
-    .groupby("cabinet_supercategory", as_index=False)["transaction_today_amt"]
-    .sum()
-)
-wdr_by_cab = (
-    dff[dff["transaction_type"] == "Withdrawals"]
-    .groupby("cabinet_supercategory", as_index=False)["transaction_today_amt"]
-    .sum()
-)
-
-tga_node_id = "tga"
-tga_label = "Treasury General Account (TGA)"
-
-# Unique IDs (internal) vs display labels (what the user sees)
-dep_by_cab["node_id"] = "dep::" + dep_by_cab["cabinet_supercategory"].astype(str)
-dep_by_cab["label"] = dep_by_cab["cabinet_supercategory"].astype(str)
-
-wdr_by_cab["node_id"] = "wdr::" + wdr_by_cab["cabinet_supercategory"].astype(str)
-wdr_by_cab["label"] = wdr_by_cab["cabinet_supercategory"].astype(str)
-
-nodes_id = dep_by_cab["node_id"].tolist() + [tga_node_id] + wdr_by_cab["node_id"].tolist()
-nodes_label = dep_by_cab["label"].tolist() + [tga_label] + wdr_by_cab["label"].tolist()
-
-node_index = {nid: i for i, nid in enumerate(nodes_id)}
-
-# Links: Deposits cabinets -> TGA
-sources = [node_index[nid] for nid in dep_by_cab["node_id"]]
-targets = [node_index[tga_node_id]] * len(dep_by_cab)
-values = dep_by_cab["transaction_today_amt"].tolist()
-
-# Links: TGA -> Withdrawals cabinets
-sources += [node_index[tga_node_id]] * len(wdr_by_cab)
-targets += [node_index[nid] for nid in wdr_by_cab["node_id"]]
-values += wdr_by_cab["transaction_today_amt"].tolist()
-
-fig = go.Figure(
-    data=[
-        go.Sankey(
-            arrangement="snap",
-            textfont=dict(size=14, color="black"),
-            node=dict(
-                label=nodes_label,  # <-- display labels (no prefixes)
-                pad=15,
-                thickness=15,
-                line=dict(color="rgba(0,0,0,0.35)", width=1),
-            ),
-            link=dict(source=sources, target=targets, value=values),
-        )
-    ]
-)
-fig.update_layout(
-    height=650,
-    margin=dict(l=10, r=10, t=10, b=10),
-    paper_bgcolor="white",
-    plot_bgcolor="white",
-    font=dict(color="black"),
-)
-
-
+# --- Sankey (gross)
 st.subheader("Cabinet-level gross flows")
-st.plotly_chart(fig, use_container_width=True)
+st.plotly_chart(build_flows_sankey(cab_sums), use_container_width=True)
 
 st.divider()
 st.subheader("Click a cabinet to drill down")
 
-# Cabinet summary table for clicking
-dep_tbl = (
-    dff[dff["transaction_type"] == "Deposits"]
-    .groupby("cabinet_supercategory", as_index=False)["transaction_today_amt"]
-    .sum()
-    .rename(columns={"transaction_today_amt": "deposits"})
-)
-wdr_tbl = (
-    dff[dff["transaction_type"] == "Withdrawals"]
-    .groupby("cabinet_supercategory", as_index=False)["transaction_today_amt"]
-    .sum()
-    .rename(columns={"transaction_today_amt": "withdrawals"})
-)
-
-cab_tbl = dep_tbl.merge(wdr_tbl, on="cabinet_supercategory", how="outer").fillna(0.0)
-cab_tbl["net"] = cab_tbl["deposits"] - cab_tbl["withdrawals"]
-cab_tbl = cab_tbl.sort_values("withdrawals", ascending=False)
-
 # Streamlit supports "row click selection" on st.dataframe in recent versions
 event = st.dataframe(
     cab_tbl.style.format({"deposits": "${:,.0f}", "withdrawals": "${:,.0f}", "net": "${:,.0f}"}),
@@ -211,16 +173,19 @@ except Exception:
 
 
 # Unmapped diagnostics (super helpful for tightening the mapping)
-unmapped = dff[dff["cabinet_supercategory"] == "Unmapped"].copy()
-if len(unmapped) > 0:
-    st.warning(f"Unmapped rows in this range: {len(unmapped):,}. Fix by adding them to your mapping file.")
+n_unmapped = 0
+if show_unmapped:
+    n_unmapped = int(cat_eq(slice_dates(df, start_date, end_date)["cabinet_supercategory"], "Unmapped").sum())
+
+if n_unmapped > 0:
+    st.warning(f"Unmapped rows in this range: {n_unmapped:,}. Fix by adding them to your mapping file.")
     top_unmapped = (
-        unmapped.groupby(["transaction_type", "transaction_catg", "transaction_catg_desc"], as_index=False)[
-            "transaction_today_amt"
-        ]
+        slice_dates(get_daily_unmapped(), start_date, end_date)
+        .groupby(
+            ["transaction_type", "transaction_catg", "transaction_catg_desc"], as_index=False, observed=True, sort=False
+        )["transaction_today_amt"]
         .sum()
-        .sort_values("transaction_today_amt", ascending=False)
-        .head(50)
+        .nlargest(50, "transaction_today_amt")
     )
     st.dataframe(
         top_unmapped.style.format({"transaction_today_amt": "${:,.0f}"}),
@@ -2,6 +2,7 @@ import sys
 from pathlib import Path
 from datetime import timedelta
 
+import numpy as np
 import pandas as pd
 import streamlit as st
 import plotly.graph_objects as go
@@ -10,25 +11,18 @@ REPO_ROOT = Path(__file__).resolve().parents[2]
 if str(REPO_ROOT) not in sys.path:
     sys.path.insert(0, str(REPO_ROOT))
 
-from app.lib.dts_loader import load_deposits_withdrawals, load_category_map, enrich_with_rollups
+from app.lib.dts_loader import cat_eq, get_daily_agency_program, get_enriched, slice_dates
 
 
 st.set_page_config(page_title="Drilldown (Cabinet → Agency → Program)", layout="wide")
 st.title("Drilldown: Cabinet → Agency → Program")
 
 
-@st.cache_data(show_spinner=True)
-def get_enriched() -> pd.DataFrame:
-    df = load_deposits_withdrawals()
-    mapping = load_category_map()
-    return enrich_with_rollups(df, mapping)
-
-
 df = get_enriched()
 
 # --- Controls
-max_date = df["record_date"].max()
-min_date = df["record_date"].min()
+max_date = df.index.max()
+min_date = df.index.min()
 default_start = max_date - timedelta(days=365)
 
 c1, c2, c3, c4 = st.columns([2, 1, 1, 1])
@@ -42,7 +36,7 @@ with c1:
     )
 
 with c2:
-    years = sorted(df["record_date"].dt.year.unique().tolist())
+    years = df.index.year.unique().tolist()
     year_choice = st.selectbox("Year (optional)", ["All"] + [str(y) for y in years], index=0)
 
 with c3:
@@ -57,11 +51,11 @@ if year_choice != "All":
     start_date = pd.Timestamp(year=y, month=1, day=1).date()
     end_date = pd.Timestamp(year=y, month=12, day=31).date()
 
-mask = (df["record_date"].dt.date >= start_date) & (df["record_date"].dt.date <= end_date)
-dff = df.loc[mask].copy()
+# Work off the cached daily rollup; every aggregate below is a sum, so the result is unchanged
+dff = slice_dates(get_daily_agency_program(), start_date, end_date)
 
 if not show_unmapped:
-    dff = dff[dff["cabinet_supercategory"] != "Unmapped"].copy()
+    dff = dff[~cat_eq(dff["cabinet_supercategory"], "Unmapped")]
 
 # Pick default cabinet
 cab_options = sorted(dff["cabinet_supercategory"].dropna().unique().tolist())
@@ -73,8 +67,8 @@ default_cab = st.session_state.get("selected_cabinet")
 if default_cab not in cab_options:
     # fallback: choose the cabinet with largest withdrawals/deposits in this window
     tmp = (
-        dff[dff["transaction_type"] == txn_type]
-        .groupby("cabinet_supercategory", as_index=False)["transaction_today_amt"]
+        dff[cat_eq(dff["transaction_type"], txn_type)]
+        .groupby("cabinet_supercategory", as_index=False, observed=True, sort=False)["transaction_today_amt"]
         .sum()
         .sort_values("transaction_today_amt", ascending=False)
     )
@@ -83,7 +77,7 @@ if default_cab not in cab_options:
 cabinet = st.selectbox("Cabinet", cab_options, index=cab_options.index(default_cab))
 
 # Filter to cabinet + transaction type
-x = dff[(dff["cabinet_supercategory"] == cabinet) & (dff["transaction_type"] == txn_type)].copy()
+x = dff[cat_eq(dff["cabinet_supercategory"], cabinet) & cat_eq(dff["transaction_type"], txn_type)]
 
 if x.empty:
     st.warning("No rows for that cabinet/transaction type in the selected range.")
@@ -97,74 +91,54 @@ st.metric(f"{txn_type} total (sum)", f"${total_amt:,.0f}")
 st.subheader("Sankey: Cabinet → Agency → Program")
 per_agency_top = st.slider("Programs per agency (top N)", min_value=5, max_value=50, value=20, step=5)
 
-# Agency totals
-agency_totals = (
-    x.groupby("agency_rollup", as_index=False)["transaction_today_amt"]
+# Program totals per agency, largest first: the only group-by over the filtered rows
+prog_amt = (
+    x.groupby(["agency_rollup", "program_rollup"], observed=True, sort=False)["transaction_today_amt"]
     .sum()
-    .rename(columns={"transaction_today_amt": "agency_total"})
-    .sort_values("agency_total", ascending=False)
+    .sort_values(ascending=False, kind="stable")
 )
+by_agency = prog_amt.groupby(level="agency_rollup", observed=True, sort=False)
 
-# Program totals per agency
-prog = (
-    x.groupby(["agency_rollup", "program_rollup"], as_index=False)["transaction_today_amt"]
-    .sum()
-    .rename(columns={"transaction_today_amt": "amt"})
-)
-
-# Keep top N programs per agency; bucket the rest into "Other"
-prog = prog.sort_values(["agency_rollup", "amt"], ascending=[True, False])
-prog["rank_within_agency"] = prog.groupby("agency_rollup")["amt"].rank(method="first", ascending=False)
-
-top_prog = prog[prog["rank_within_agency"] <= per_agency_top].copy()
-other_prog = prog[prog["rank_within_agency"] > per_agency_top].copy()
+# Agency totals
+agency_sum = by_agency.sum()
+agency_totals = agency_sum.rename("agency_total").sort_values(ascending=False).reset_index()
 
-if not other_prog.empty:
-    other_prog = (
-        other_prog.groupby("agency_rollup", as_index=False)["amt"]
-        .sum()
-        .assign(program_rollup="Other (all remaining programs)")
-    )
-    prog2 = pd.concat([top_prog.drop(columns=["rank_within_agency"]), other_prog], ignore_index=True)
-else:
-    prog2 = top_prog.drop(columns=["rank_within_agency"])
+# Keep top N programs per agency; the remainder of each agency's total is its "Other" bucket
+top_prog = by_agency.head(per_agency_top)
+has_other = by_agency.size() > per_agency_top
+other_prog = (agency_sum - top_prog.groupby(level="agency_rollup", observed=True, sort=False).sum())[has_other]
 
 # --- Build Sankey nodes (unique IDs + clean display labels)
-cab_id = "cab"
 cab_label = str(cabinet)
 
-agency_totals = agency_totals.copy()
 agency_totals["agency_id"] = "agency::" + agency_totals["agency_rollup"].astype(str)
 agency_totals["agency_label"] = agency_totals["agency_rollup"].astype(str)
 
-# Programs: keep unique IDs using agency+program, but display only program name
-prog2 = prog2.copy()
-prog2["program_id"] = (
-    "program::" + prog2["agency_rollup"].astype(str) + "||" + prog2["program_rollup"].astype(str)
+prog_agency = np.concatenate([
+    top_prog.index.get_level_values("agency_rollup").astype(str),
+    other_prog.index.astype(str),
+])
+prog_labels = (
+    top_prog.index.get_level_values("program_rollup").astype(str).tolist()
+    + ["Other (all remaining programs)"] * len(other_prog)
 )
-prog2["program_label"] = prog2["program_rollup"].astype(str)
 
-nodes_id = [cab_id] + agency_totals["agency_id"].tolist() + prog2["program_id"].tolist()
-nodes_label = [cab_label] + agency_totals["agency_label"].tolist() + prog2["program_label"].tolist()
+# Node order is [cabinet] + agencies + programs, so indices are plain positions
+nodes_label = [cab_label] + agency_totals["agency_label"].tolist() + prog_labels
 
-node_index = {nid: i for i, nid in enumerate(nodes_id)}
+n_agency = len(agency_totals)
+# Each program's agency node is its agency's code in agency_totals order, offset past the cabinet
+prog_agency_codes = pd.Categorical(prog_agency, categories=agency_totals["agency_label"]).codes.astype(np.int64)
+program_idx = np.arange(n_agency + 1, n_agency + 1 + len(prog_labels))
 
-sources = []
-targets = []
-values = []
-
-# Links: Cabinet -> Agency
-for _, r in agency_totals.iterrows():
-    sources.append(node_index[cab_id])
-    targets.append(node_index[r["agency_id"]])
-    values.append(float(r["agency_total"]))
-
-# Links: Agency -> Program
-for _, r in prog2.iterrows():
-    agency_id = "agency::" + str(r["agency_rollup"])
-    sources.append(node_index[agency_id])
-    targets.append(node_index[r["program_id"]])
-    values.append(float(r["amt"]))
+# Links: Cabinet -> Agency, then Agency -> Program
+sources = np.concatenate([np.zeros(n_agency, dtype=np.int64), prog_agency_codes + 1])
+targets = np.concatenate([np.arange(1, n_agency + 1), program_idx])
+values = np.concatenate([
+    agency_totals["agency_total"].to_numpy(dtype=np.float64),
+    top_prog.to_numpy(dtype=np.float64),
+    other_prog.to_numpy(dtype=np.float64),
+])
 
 fig = go.Figure(
     data=[
@@ -200,11 +174,7 @@ st.dataframe(
 )
 
 st.subheader("Top programs (within agencies)")
-top_programs = (
-    prog.sort_values("amt", ascending=False)[["agency_rollup", "program_rollup", "amt"]]
-    .head(100)
-    .rename(columns={"amt": "amount"})
-)
+top_programs = prog_amt.head(100).rename("amount").reset_index()
 st.dataframe(
     top_programs.style.format({"amount": "${:,.0f}"}),
     use_container_width=True,
@@ -213,9 +183,10 @@ st.dataframe(
 
 # Unmapped hint
 if show_unmapped:
-    unm = x[(x["agency_rollup"] == "Unmapped") | (x["program_rollup"] == "Unmapped")]
-    if len(unm) > 0:
+    unm = x[cat_eq(x["agency_rollup"], "Unmapped") | cat_eq(x["program_rollup"], "Unmapped")]
+    n_unm = int(unm["rows"].sum())
+    if n_unm > 0:
         st.warning(
-            f"This cabinet has {len(unm):,} rows with unmapped agency/program in the selected range. "
+            f"This cabinet has {n_unm:,} rows with unmapped agency/program in the selected range. "
             "Update your mapping file to improve drilldown."
         )